@@ -1,2 +1,3 @@
 from .graph_all import Grapher
-from .gen_stats import StatGenerator
\ No newline at end of file
+from .gen_stats import StatGenerator
+from .watch_trials import TrialWatcher
\ No newline at end of file
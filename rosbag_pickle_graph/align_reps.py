@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+from __future__ import print_function
+import numpy as np
+
+
+
+# Align reps of a trial by the lag that best matches a reference signal
+#   Each rep is resampled onto a uniform grid, then all reps are
+#   cross-correlated with the first one at once using batched FFTs.
+
+
+# Get a 1D signal for each rep: one column, or the norm over columns (e.g. force magnitude)
+def _get_signal(run, column=None):
+    run_data = np.asarray(run['data'], dtype=float)
+    if run_data.ndim == 1:
+        return run_data
+    if column is not None:
+        return run_data[:,column]
+    return np.linalg.norm(run_data, axis=1)
+
+
+# Estimate the time lag of each rep relative to the first rep (in the same units as the timestamps)
+#   Subtracting a rep's lag from its timestamps lines it up with the first rep
+#   max_lag: largest lag to search for, including the difference in start times (None searches all lags)
+#   onset:   align on the rate of change instead (better for step-like signals such as contact force)
+def estimate_lags(runs, column=None, max_lag=None, onset=False):
+    times = [np.asarray(run['timestamp'], dtype=float) for run in runs]
+    if len(runs) < 2:
+        return np.zeros(len(runs))
+
+    # Resample every rep onto a grid with the median sample period (repeated timestamps are ignored)
+    diffs = np.concatenate([np.diff(t) for t in times])
+    diffs = diffs[diffs > 0]
+    if len(diffs)==0:
+        raise ValueError("Can't align reps without distinct timestamps")
+    dt = np.median(diffs)
+    length = int(max([np.ceil((t[-1]-t[0])/dt) for t in times]))+1
+    grid = np.arange(length)*dt
+
+    signals = np.zeros((len(runs), length))
+    for idx, run in enumerate(runs):
+        signal = np.interp(grid+times[idx][0], times[idx], _get_signal(run, column), right=np.nan)
+        valid = ~np.isnan(signal)
+        signal = signal[valid]
+        if onset:
+            signal = np.gradient(signal)
+        signals[idx, valid] = signal - np.mean(signal)
+
+    # Batched cross-correlation with the first rep (zero-padded so it isn't circular)
+    nfft = 1
+    while nfft < 2*length:
+        nfft *= 2
+    spectra = np.fft.rfft(signals, n=nfft, axis=1)
+    xcorr = np.fft.irfft(spectra*np.conj(spectra[0]), n=nfft, axis=1)
+
+    # Each shift of the resampled signals is a lag of (start time difference + shift)
+    shifts = np.arange(nfft)
+    shifts[shifts >= nfft//2] -= nfft
+    starts = np.array([t[0] for t in times])
+    lags = (starts - starts[0])[:, None] + shifts[None, :]*dt
+    if max_lag is not None:
+        xcorr[np.abs(lags) > max_lag] = -np.inf
+
+    best = np.argmax(xcorr, axis=1)
+    return lags[np.arange(len(runs)), best]
+
+
+# Shift the timestamps of each rep of every field by its lag (onto the first rep's timeline)
+def apply_lags(data, lags):
+    data_out = {}
+    for key_y in data:
+        data_out[key_y] = []
+        for idx, run in enumerate(data[key_y]):
+            run_out = dict(run)
+            run_out['timestamp'] = np.asarray(run['timestamp'], dtype=float) - lags[idx]
+            data_out[key_y].append(run_out)
+    return data_out
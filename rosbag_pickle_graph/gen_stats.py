@@ -11,6 +11,11 @@ from itertools import cycle
 
 from .graph_all import Grapher
 from .handle_data import DataHandler
+from .trial_index import TrialIndex
+from .trial_catalog import TrialCatalog
+from . import stat_reducers
+from . import stat_pyramid
+from . import align_reps
 
 
 class StatGenerator:
@@ -29,8 +34,19 @@ class StatGenerator:
         self.source_base_dir = None
         self.dest_dir = None
         self.file_list = None
+        self.file_list_subset = False
+        self.file_extension = '.pkl'
         self.data_set = None
-
+        self.index = None
+        self.catalog = None
+        self.reducers = []
+        self.build_pyramids = True
+        self.pyramid_factor = 4
+        self.pyramid_min_length = 64
+        self.align_field = None
+        self.align_column = None
+        self.align_max_lag = None
+        self.align_onset = False
 
 
     # SETUP FUNCTIONS
@@ -68,6 +84,42 @@ class StatGenerator:
         self.graph.set_yfields(yfields)
 
 
+    # Set a trial metadata index file (SQLite) to select trials from
+    def set_index(self, filename):
+        if self.index is not None:
+            self.index.close()
+        self.index = TrialIndex(filename)
+
+
+    # Set extra reducers to run over the stack of reps when calculating stats
+    #   (mean and stdev are always calculated). See "stat_reducers" for options
+    def set_reducers(self, reducers):
+        self.reducers = list(reducers)
+
+
+    # Set how downsampled summary levels are built for fast overview plots
+    def set_pyramid_props(self, build=None, factor=None, min_length=None):
+        if build is not None:
+            self.build_pyramids = build
+        if factor is not None:
+            self.pyramid_factor = factor
+        if min_length is not None:
+            self.pyramid_min_length = min_length
+
+
+    # Align reps by cross-correlating a reference y-field before calculating stats
+    #   yfield:  the y-field to align on (e.g. the wrench force), or None to turn alignment off
+    #   column:  the column of the y-field to use. Defaults to the norm of all columns
+    #   max_lag: the largest time lag (shift of a rep's timestamps) to search for. Windowed reads are widened by it
+    #            (without it, windowed runs read whole trials)
+    #   onset:   align on the rate of change of the y-field (e.g. force onset at contact)
+    def set_alignment(self, yfield, column=None, max_lag=None, onset=False):
+        self.align_field = yfield
+        self.align_column = column
+        self.align_max_lag = max_lag
+        self.align_onset = onset
+
+
     def get_graph_handler(self):
         return self.graph
 
@@ -97,6 +149,82 @@ class StatGenerator:
         return (-1, None)
 
 
+    # Get the bin key ("term1;term2") of a trial folder name, or None if it doesn't match every sort list
+    def _get_bin_key(self, name, sort_terms):
+        num_sort_types = self._get_deepest_list_level(sort_terms)
+        sorted_terms = []
+        for st_idx in range(num_sort_types):
+            curr_st, curr_st_name  = self._find_from_substring_list(name,sort_terms[st_idx])
+            if curr_st == -1:
+                return None
+            sorted_terms.append(curr_st_name)
+
+        return ';'.join(sorted_terms)
+
+
+    # Get the output file (without extension) for a bin and position
+    def _get_out_file_group(self, bin_key, pos_num):
+        return os.path.join(self.dest_dir,
+                            self.data_set,
+                            bin_key.replace(';','__'),
+                            "pos%04d"%(pos_num))
+
+
+    # Get the names of the stats made by the current reducers
+    def _get_reducer_keys(self):
+        keys = set(stat_reducers.mean_stdev(np.zeros((2,1,1))).keys())
+        for reducer in self.reducers:
+            keys.update(reducer(np.zeros((2,1,1))).keys())
+        return keys
+
+
+    # Check that loaded stats have every stat made by the current reducers
+    def _has_reducer_stats(self, stats):
+        keys = self._get_reducer_keys()
+        for key_pos in stats:
+            if key_pos == 'meta':
+                continue
+            for key_y in stats[key_pos]['data']:
+                if not keys.issubset(stats[key_pos]['data'][key_y].keys()):
+                    return False
+        return True
+
+
+    # Get the alignment settings stored with stats (None if reps aren't aligned)
+    def _get_alignment(self):
+        if self.align_field is None:
+            return None
+        return {'field': self.align_field,
+                'column': self.align_column,
+                'max_lag': self.align_max_lag,
+                'onset': self.align_onset}
+
+
+    # Check that loaded stats were made with the current alignment settings
+    def _has_alignment(self, stats):
+        alignment = self._get_alignment()
+        for key_pos in stats:
+            if key_pos == 'meta':
+                continue
+            if stats[key_pos].get('alignment', None) != alignment:
+                return False
+        return True
+
+
+    # Widen a time window by the largest alignment lag so aligned reps still cover it
+    def _get_read_window(self, t_start, t_end):
+        if self.align_field is None:
+            return (t_start, t_end)
+        if self.align_max_lag is None:
+            return (None, None)
+
+        if t_start is not None:
+            t_start = t_start - self.align_max_lag
+        if t_end is not None:
+            t_end = t_end + self.align_max_lag
+        return (t_start, t_end)
+
+
     # Get the number of levels in a list
     def _get_deepest_list_level(self, list_in):
         if type(list_in) is list:
@@ -107,7 +235,7 @@ class StatGenerator:
 
     # Get stats from a summary file
     def _get_summary(self,filename):
-        with open(filename,'r') as f:
+        with open(filename,'rb') as f:
             stats = pickle.load(f)
         print('Loaded stats from summary file')
 
@@ -115,11 +243,11 @@ class StatGenerator:
 
 
     # Save stats to a summary file
-    def _save_summary(self, stats, metadata):
+    def _save_summary(self, stats, metadata, overwrite=False):
         stat_file = metadata['summary_file']
-        if not metadata['summary_exists'] :
+        if not metadata['summary_exists'] or overwrite:
             print('Saving: %s'%(stat_file))
-            with open(stat_file,'w') as f:
+            with open(stat_file,'wb') as f:
                 pickle.dump(stats,f)
         else:
             print('Already Saved: %s'%(stat_file))
@@ -145,102 +273,176 @@ class StatGenerator:
 
         print("Number of files: %d, Number of folders: %d"%(num_files, len(unique_roots)))
         self.data_set = data_set
+        self.file_extension = extension
+        self.file_list_subset = False
         self.file_list = self._get_files_recursively(os.path.join(self.source_base_dir,data_set), extension)
 
 
+    # Add new or changed trials in the data set to the trial index (each trial is unpickled once)
+    #   Success flags are re-read for every trial since success files are often written later
+    #   The index stores the sort terms and trial regex it was built with. If they change,
+    #   the bins and positions of indexed trials are recalculated (without unpickling them)
+    def update_index(self, sort_terms, trial_regex=r'pos_(\d+)_'):
+        if self.index is None:
+            print("No trial index set")
+            return
+
+        rebin = (self.index.get_setting('sort_terms') != sort_terms
+                 or self.index.get_setting('trial_regex') != trial_regex)
+
+        match_pos = re.compile(trial_regex)
+        success_entries = {}
+        num_updated = 0
+        for root, full_file in self._get_files_recursively(os.path.join(self.source_base_dir,self.data_set), self.file_extension):
+            bin_key = self._get_bin_key(os.path.basename(root), sort_terms)
+            pos_match = match_pos.search(os.path.basename(full_file))
+            if bin_key is None or pos_match is None:
+                if rebin:
+                    self.index.remove_trial(full_file, commit=False)
+                continue
+
+            if root not in success_entries:
+                success_entries[root] = self.index.read_success_file(root)
+            success = self.index.get_success(full_file, success_entries[root])
+
+            if not self.index.needs_update(full_file):
+                if rebin:
+                    self.index.set_group(full_file, bin_key, int(pos_match.group(1)), commit=False)
+                self.index.set_success(full_file, success, commit=False)
+                continue
+
+            summary = self.index.summarize_raw_data(self.dh.load_raw_data(full_file))
+            self.index.add_trial(full_file, bin_key, int(pos_match.group(1)),
+                                 success = success,
+                                 summary = summary,
+                                 commit  = False)
+            num_updated+=1
+
+        self.index.set_setting('sort_terms', sort_terms, commit=False)
+        self.index.set_setting('trial_regex', trial_regex, commit=False)
+        self.index.commit()
+        num_removed = self.index.remove_missing()
+        print("Trial index: %d trials updated, %d removed"%(num_updated, num_removed))
+
+
+    # Select the files to sort from the trial index instead of the file system (see TrialIndex.query)
+    #   Summary files cover whole folders, so they are never read or written for a selected subset
+    def select_filenames(self, **kwargs):
+        if self.index is None:
+            print("No trial index set")
+            return
+
+        data_set_dir = os.path.join(self.source_base_dir,self.data_set)
+        paths = self.index.query(**kwargs)
+        paths = [path for path in paths if path.startswith(data_set_dir+os.sep)]
+
+        print("Number of files selected: %d"%(len(paths)))
+        self.file_list = [(os.path.dirname(path), path) for path in paths]
+        self.file_list_subset = True
+
+
     # Sort filenames into bins using a set of sort lists
     def sort_filenames(self,sort_terms, trial_regex='pos_(\d+)_' ):
         if self.file_list is None:
             print("No files to sort")
             return
 
-        num_sort_types = self._get_deepest_list_level(sort_terms)
-        files_binned = {}
+        catalog = TrialCatalog()
+        catalog.subset = self.file_list_subset
+        catalog.data_set = self.data_set
+        catalog.source_base_dir = self.source_base_dir
         match_pos = re.compile(trial_regex)
 
-        idx = 0
         for root, full_file in self.file_list:        
             # Check if the name contains one of the keywords for each variable
             name = os.path.basename(os.path.dirname(full_file))
             pos_name = os.path.basename(full_file)
             pos_num = int(match_pos.search(pos_name).group(1))
             
-            out_file = os.path.join(self.dest_dir,os.path.relpath(full_file,start=self.source_base_dir))
-            
-            sorted_terms = []
-            sorted_comb  = ""
-            for st_idx in range(num_sort_types):
-                curr_st, curr_st_name  = self._find_from_substring_list(name,sort_terms[st_idx])
-
-                if curr_st != -1:
-                    sorted_terms.append({'idx': curr_st, 'name':curr_st_name})
-
-                    if st_idx != 0:
-                        sorted_comb += ';'
-                    sorted_comb += curr_st_name
+            sorted_comb = self._get_bin_key(name, sort_terms)
             
             # if the data is not part of the set we care about, don't include it.
-            if len(sorted_terms)!=num_sort_types:
+            if sorted_comb is None:
                 continue
 
-            # Split out the filenames into bins
-            # If bins haven't been created yet, make them
-            if files_binned.get(sorted_comb,None) is None:
-                files_binned[sorted_comb] = {}
-            
-            if files_binned[sorted_comb].get(pos_num,None) is None:
-                files_binned[sorted_comb][pos_num] = {}
-
-            if files_binned[sorted_comb][pos_num].get('data_files',None) is None:
-                files_binned[sorted_comb][pos_num]['data_files'] = []
-                
             # Check if a summary file already exists
             summary_file=os.path.join(root,'summary.stat')
-            out_file_group= os.path.join(self.dest_dir,
-                                         self.data_set,
-                                         sorted_comb.replace(';','__'),
-                                         "pos%04d"%(pos_num))
-            files_binned[sorted_comb]['meta'] = {'summary_file': summary_file}
-            files_binned[sorted_comb][pos_num]['out_file'] = out_file_group
-            files_binned[sorted_comb][pos_num]['data_files'].append(full_file)
-
-                
-                
-            if os.path.exists(summary_file):
+            summary_exists = os.path.exists(summary_file)
+
+            # Split out the filenames into bins
+            catalog.add(full_file, sorted_comb, pos_num, summary_file, summary_exists)
+
+            if summary_exists:
                 print('Summary file already exists in this folder')
-                files_binned[sorted_comb]['meta']['summary_exists'] = True
                 continue
             
-            files_binned[sorted_comb]['meta']['summary_exists'] = False
             print(full_file)
 
-        self.files_binned = files_binned  
+        self.catalog = catalog
+
+
+    # Save the sorted trial catalog to a file so other stages can reuse it
+    def save_catalog(self, filename):
+        self.catalog.save(filename)
+
+
+    # Load a sorted trial catalog from a file instead of sorting filenames
+    #   The data set and source directory are restored from the catalog
+    def load_catalog(self, filename):
+        self.catalog = TrialCatalog.load(filename)
+        self.catalog.refresh_summaries()
+        self.data_set = self.catalog.data_set
+        if self.catalog.source_base_dir is not None:
+            self.source_base_dir = self.catalog.source_base_dir
     
 
     # Get data    
-    def get_data(self, force_new_summary=False):
+    #   t_start, t_end: only use data within this time window. Windowed stats
+    #   (and stats of a subset selected from the trial index) are never read
+    #   from or saved to summary files
+    def get_data(self, force_new_summary=False, t_start=None, t_end=None):
+        skip_summary = (t_start is not None) or (t_end is not None) or self.catalog.subset
         allstats={}
-        for key_obj in self.files_binned:
+        for key_obj in self.catalog.bins:
             print('Set: %s'%(key_obj))
-            meta=self.files_binned[key_obj].get('meta')
-            if meta['summary_exists'] and not force_new_summary:
+            meta=self.catalog.get_meta(key_obj)
+            stats = None
+            outdated = False
+            if meta['summary_exists'] and not force_new_summary and not skip_summary:
                 stats = self._get_summary(meta['summary_file'])
-            else:
+
+                # Summaries made before a reducer was added don't have its stats
+                if not self._has_reducer_stats(stats):
+                    print('Summary is missing stats from the current reducers, recalculating')
+                    stats = None
+                    outdated = True
+
+                # Summaries made with other alignment settings have differently shifted reps
+                elif not self._has_alignment(stats):
+                    print('Summary was made with different alignment settings, recalculating')
+                    stats = None
+                    outdated = True
+
+            if stats is None:
                 stats = {}
-                stats['meta']=self.files_binned[key_obj]['meta']
-                for key_pos in self.files_binned[key_obj]:
-                    if key_pos is 'meta':
-                        continue
+                stats['meta']=meta
+                # Aligned reps are shifted after reading, so read a wider window
+                read_start, read_end = self._get_read_window(t_start, t_end)
+                for key_pos, data_files in self.catalog.get_positions(key_obj):
+                    out_file = self._get_out_file_group(key_obj, key_pos)
                     print('\tPosition: %s'%(key_pos))
-                    print('\t\tAveraging data from %d files'%(len(self.files_binned[key_obj][key_pos]['data_files'])))
-                    data_curr  = self.get_raw_data(file_list = self.files_binned[key_obj][key_pos]['data_files'],
-                                                   out_file  = self.files_binned[key_obj][key_pos]['out_file'])
+                    print('\t\tAveraging data from %d files'%(len(data_files)))
+                    data_curr  = self.get_raw_data(file_list = data_files,
+                                                   out_file  = out_file,
+                                                   t_start   = read_start,
+                                                   t_end     = read_end)
                     print('\t\tCalculating Stats')
-                    stats_curr = self.calculate_stats(data_curr)
+                    stats_curr = self.calculate_stats(data_curr, t_start=t_start, t_end=t_end)
                     stats[key_pos] = stats_curr
-                    stats[key_pos]['out_file'] = self.files_binned[key_obj][key_pos]['out_file']
+                    stats[key_pos]['out_file'] = out_file
 
-                self._save_summary(stats, meta)
+                if not skip_summary:
+                    self._save_summary(stats, meta, overwrite=outdated)
             allstats[key_obj] = stats
 
         self.allstats=allstats
@@ -248,13 +450,13 @@ class StatGenerator:
     
 
     # Get raw data from a list of files
-    def get_raw_data(self, file_list, out_file, save=True):
+    def get_raw_data(self, file_list, out_file, save=True, t_start=None, t_end=None):
         idx = 0
         data_out = {}
         for full_file in file_list: 
             # Get the data and process it
             self.dh.set_filenames(full_file, out_file)            
-            curr_data = self.dh.get_data(full_file)
+            curr_data = self.dh.get_data(full_file, t_start, t_end)
             for key in curr_data:
                 if data_out.get(key,None) is None:
                     data_out[key] = []
@@ -274,8 +476,19 @@ class StatGenerator:
 
 
     # Calculate statistics for an organized set of data
-    def calculate_stats(self, data, metadata=None, plot_intermediate=False):
-        stats_curr = {}
+    #   t_start, t_end: only calculate stats within this time window (after alignment)
+    def calculate_stats(self, data, metadata=None, plot_intermediate=False, t_start=None, t_end=None):
+        stats_curr = {'alignment': self._get_alignment()}
+
+        # Shift the reps to line up with each other before resampling
+        if self.align_field is not None:
+            lags = align_reps.estimate_lags(data[self.dh.yfield_to_key(self.align_field)],
+                                            column  = self.align_column,
+                                            max_lag = self.align_max_lag,
+                                            onset   = self.align_onset)
+            data = align_reps.apply_lags(data, lags)
+            stats_curr['lags'] = lags
+
         # For all y_fields find the latest start time and the earliest end time
         min_time = 0
         max_time = np.inf
@@ -285,6 +498,8 @@ class StatGenerator:
             stats_curr['num_reps'] = len(data_curr)
             for run in data_curr:
                 stamp = run['timestamp']
+                if len(stamp)==0:
+                    raise ValueError("A rep of '%s' has no samples between t=%s and t=%s"%(key_y, t_start, t_end))
                 min_stamp = np.min(stamp)
                 max_stamp = np.max(stamp)
 
@@ -297,10 +512,18 @@ class StatGenerator:
                 if base_time is None:
                     base_time = np.array(stamp)
 
+        # Limit the ends to the time window
+        if t_start is not None:
+            min_time = max(min_time, t_start)
+        if t_end is not None:
+            max_time = min(max_time, t_end)
+
         # Chop the base time to match the conservative ends
         base_time = base_time[base_time>min_time]
         base_time = base_time[base_time<max_time]
 
+        if len(base_time)==0:
+            raise ValueError("No samples where all reps overlap between t=%s and t=%s"%(min_time, max_time))
 
         stats_curr['timestamp'] = base_time
         stats_curr['data'] = {}
@@ -323,16 +546,28 @@ class StatGenerator:
                 run_time=np.array(run['timestamp'])
                 run_data=np.array(run['data'])
 
+                # Keep one sample past each end of the window so it stays inside the interpolation
+                start, end = self.dh.get_window(run_time, t_start, t_end, pad=1)
+                run_time = run_time[start:end]
+                run_data = run_data[start:end]
+
                 if plot_intermediate:
                     plt.plot(run_data, linewidth=0.25)
 
                 interp_fun = interp.interp1d(run_time,run_data, axis=0)
                 data_interp['data'].append(interp_fun(base_time))
 
+            # Run all reducers over the (reps, T, k) stack
             curr_ydata = np.array(data_interp['data'])
-            means = np.mean(curr_ydata,axis=0)
-            stdev = np.std(curr_ydata,axis=0)
-            stats_curr['data'][key_y]={'mean': means, 'stdev': stdev}
+            stats_curr['data'][key_y] = stat_reducers.mean_stdev(curr_ydata)
+            for reducer in self.reducers:
+                stats_curr['data'][key_y].update(reducer(curr_ydata))
+
+        # Build the downsampled levels once so plots don't have to
+        if self.build_pyramids:
+            stats_curr['levels'] = stat_pyramid.build_pyramid(stats_curr,
+                                                              factor=self.pyramid_factor,
+                                                              min_length=self.pyramid_min_length)
 
         return stats_curr
 
@@ -343,7 +578,7 @@ class StatGenerator:
 
 
     # Plot the data
-    def plot_stats(self, allstats = None, save=True):
+    def plot_stats(self, allstats = None, save=True, line='mean', band=None, full_res=False):
         if allstats is None:
             allstats = self.allstats
 
@@ -356,22 +591,20 @@ class StatGenerator:
 
                 if self.plot_means:
                     if save:
-                        self.graph.plot_stats(data, save_loc = out_file )
+                        self.graph.plot_stats(data, save_loc = out_file, line=line, band=band, full_res=full_res)
                     else:
-                        self.graph.plot_stats(data)
+                        self.graph.plot_stats(data, line=line, band=band, full_res=full_res)
 
 
     # Get all the raw data
     def plot_all_raw_data(self, save=True):
-        for key_obj in self.files_binned:
+        for key_obj in self.catalog.bins:
             data = {}
             print('Set: %s'%(key_obj))
-            for key_pos in self.files_binned[key_obj]:
-                if key_pos is 'meta':
-                    continue
+            for key_pos, data_files in self.catalog.get_positions(key_obj):
                 print('\tPosition: %s'%(key_pos))
-                print('\t\tReading data from %d files'%(len(self.files_binned[key_obj][key_pos]['data_files'])))
-                data_curr  = self.get_raw_data(file_list = self.files_binned[key_obj][key_pos]['data_files'],
-                                               out_file  = self.files_binned[key_obj][key_pos]['out_file'],
+                print('\t\tReading data from %d files'%(len(data_files)))
+                data_curr  = self.get_raw_data(file_list = data_files,
+                                               out_file  = self._get_out_file_group(key_obj, key_pos),
                                                save = save)
                 data[key_pos] = data_curr
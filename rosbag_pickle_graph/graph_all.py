@@ -3,10 +3,19 @@ from __future__ import print_function
 import sys
 import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import matplotlib.pyplot as plt
+import matplotlib.image as mpimg
+from matplotlib.collections import PolyCollection
 from itertools import cycle
 
 from .handle_data import DataHandler
+from . import stat_pyramid
+
+
+# Formats that can be encoded straight from the rendered pixel buffer: {extension: encoder format}
+RASTER_FORMATS = {'png': 'png', 'jpg': 'jpeg', 'jpeg': 'jpeg', 'tif': 'tiff', 'tiff': 'tiff'}
 
 
 
@@ -24,6 +33,10 @@ class Grapher:
         self.fig_size=(6.5, 3)
         self.fig_dpi=300
         self.tight_layout = False
+        self.show_plots = True
+        self.save_formats = ['png', 'svg']
+        self.rasterize_dense = True
+        self.dense_threshold = 1000
         self.dh = DataHandler()
 
     
@@ -41,7 +54,8 @@ class Grapher:
 
 
     # Set figure sizing properties
-    def set_fig_props(self, figsize=None, dpi=None, tight_layout=None):
+    #   show: show each figure after plotting it (turn off to render without blocking)
+    def set_fig_props(self, figsize=None, dpi=None, tight_layout=None, show=None):
         if figsize is not None:
             self.fig_size = figsize
 
@@ -51,6 +65,43 @@ class Grapher:
         if tight_layout is not None:
             self.tight_layout  = tight_layout
 
+        if show is not None:
+            self.show_plots = show
+
+
+
+    # Set figure saving properties
+    #   formats:         file extensions to save (e.g. ['png', 'svg', 'pdf'])
+    #   rasterize_dense: embed dense traces and bands as images in vector outputs
+    #   dense_threshold: number of points above which a trace or band is dense
+    def set_save_props(self, formats=None, rasterize_dense=None, dense_threshold=None):
+        if formats is not None:
+            self.save_formats = [fmt.lower().lstrip('.') for fmt in formats]
+
+        if rasterize_dense is not None:
+            self.rasterize_dense = rasterize_dense
+
+        if dense_threshold is not None:
+            self.dense_threshold = dense_threshold
+
+
+
+    # HELPERS
+    #------------------------------
+
+    # Rasterize dense lines and bands so vector outputs keep only axes and text as vectors
+    def _rasterize_dense_artists(self, fig):
+        for ax in fig.get_axes():
+            for line in ax.get_lines():
+                if len(line.get_xdata()) >= self.dense_threshold:
+                    line.set_rasterized(True)
+
+            for collection in ax.collections:
+                if isinstance(collection, PolyCollection):
+                    num_points = sum(len(path.vertices) for path in collection.get_paths())
+                    if num_points >= self.dense_threshold:
+                        collection.set_rasterized(True)
+
 
 
     # MAKE FIGURES
@@ -63,7 +114,8 @@ class Grapher:
 
 
     # Plot the current data
-    def plot_data(self, curr_data, save_loc=None):
+    #   t_start, t_end: only plot data within this time window
+    def plot_data(self, curr_data, save_loc=None, t_start=None, t_end=None):
         self.new_plot()
         success = curr_data.get('success',None)
         # Plot each y-field in a new subplot
@@ -71,7 +123,8 @@ class Grapher:
         for idx, y_field in enumerate(self.y_fields):
             key = self.dh.yfield_to_key(y_field)
             plt.subplot(N, 1, idx+1)
-            plt.plot(curr_data[key]['timestamp'], curr_data[key]['data'], linewidth=0.575)
+            start, end = self.dh.get_window(np.array(curr_data[key]['timestamp']), t_start, t_end)
+            plt.plot(curr_data[key]['timestamp'][start:end], curr_data[key]['data'][start:end], linewidth=0.575)
             plt.xlabel(self.x_field)
             plt.ylabel(y_field['field'])
 
@@ -90,11 +143,15 @@ class Grapher:
         if save_loc is not None:
             self.save_plot(save_loc)
 
-        plt.show()
+        if self.show_plots:
+            plt.show()
 
 
     # Plot statistics
-    def plot_stats(self,in_stats, palette=None, save_loc=None ):
+    #   line: stat to draw as the center line
+    #   band: (lower, upper) stat names to fill between. Defaults to mean +/- stdev
+    #   full_res: always plot every sample instead of the summary level matching the figure width
+    def plot_stats(self,in_stats, palette=None, save_loc=None, line='mean', band=None, full_res=False):
         # Unpack the data
         data = in_stats.get('data',None)
         time = in_stats.get('timestamp',None)
@@ -105,6 +162,15 @@ class Grapher:
 
         self.new_plot()
 
+        # Use the coarsest summary level that still has a sample per pixel
+        level = None
+        if not full_res:
+            max_points = int(self.fig_size[0]*self.fig_dpi)
+            level = stat_pyramid.select_level(in_stats.get('levels',[]), max_points)
+        if level is not None:
+            data = level['data']
+            time = level['timestamp']
+
         # Get the color palette to use
         if palette is None:
             prop_cycle = plt.rcParams['axes.prop_cycle']
@@ -116,12 +182,30 @@ class Grapher:
         for y_field in self.y_fields:
             colors = cycle(palette)
             key = self.dh.yfield_to_key(y_field)
+            for stat_name in [line] + list(band or []):
+                if stat_name not in data[key]:
+                    raise KeyError("Stat '%s' is missing for '%s'. Add its reducer with StatGenerator.set_reducers and recalculate the stats"%(stat_name, key))
+
             plt.subplot(N, 1, idx+1)
-            plt.plot(time, data[key]['mean'], linewidth=0.575, color='k')
-            for col_idx in range(data[key]['mean'].shape[1]):
+            if level is not None:
+                if band is None:
+                    lower = data[key]['band_min']
+                    upper = data[key]['band_max']
+                else:
+                    lower = data[key][band[0]+'_min']
+                    upper = data[key][band[1]+'_max']
+            elif band is None:
+                lower = data[key]['mean']-data[key]['stdev']
+                upper = data[key]['mean']+data[key]['stdev']
+            else:
+                lower = data[key][band[0]]
+                upper = data[key][band[1]]
+
+            plt.plot(time, data[key][line], linewidth=0.575, color='k')
+            for col_idx in range(data[key][line].shape[1]):
                 plt.fill_between(time,
-                     data[key]['mean'][:,col_idx]-data[key]['stdev'][:,col_idx],
-                     data[key]['mean'][:,col_idx]+data[key]['stdev'][:,col_idx],
+                     lower[:,col_idx],
+                     upper[:,col_idx],
                      color=next(colors))
             plt.ylabel(y_field['field'])
 
@@ -154,7 +238,8 @@ class Grapher:
         if save_loc is not None:
             self.save_plot(save_loc)
 
-        plt.show()
+        if self.show_plots:
+            plt.show()
 
 
 
@@ -169,5 +254,33 @@ class Grapher:
 
             file_blank = file.replace('.pkl','')
 
-            plt.savefig(os.path.join(folder,file_blank+'.png'))
-            plt.savefig(os.path.join(folder,file_blank+'.svg'))
+            fig = plt.gcf()
+            if self.rasterize_dense:
+                self._rasterize_dense_artists(fig)
+
+            raster_formats = [fmt for fmt in self.save_formats if fmt in RASTER_FORMATS]
+            vector_formats = [fmt for fmt in self.save_formats if fmt not in RASTER_FORMATS]
+            if not hasattr(fig.canvas, 'buffer_rgba'):
+                raster_formats = []
+                vector_formats = self.save_formats
+
+            # Draw once and encode every raster format from the same pixels in the background
+            #   Encoding errors are re-raised here when each result is collected
+            with ThreadPoolExecutor(max_workers=max(len(raster_formats),1)) as executor:
+                futures = []
+                if len(raster_formats)>0:
+                    fig.canvas.draw()
+                    pixels = np.array(fig.canvas.buffer_rgba())
+                    for fmt in raster_formats:
+                        futures.append(executor.submit(mpimg.imsave,
+                                                       os.path.join(folder,file_blank+'.'+fmt),
+                                                       pixels,
+                                                       format=RASTER_FORMATS[fmt],
+                                                       dpi=fig.dpi))
+
+                # Vector formats need their own render
+                for fmt in vector_formats:
+                    fig.savefig(os.path.join(folder,file_blank+'.'+fmt), format=fmt)
+
+                for future in futures:
+                    future.result()
@@ -3,6 +3,7 @@ from __future__ import print_function
 import sys
 import os
 import pickle
+import numpy as np
 import matplotlib.pyplot as plt
 from itertools import cycle
 
@@ -23,6 +24,7 @@ class DataHandler:
         self.fig_dpi=300
         self.tight_layout = False
         self.full_files = []
+        self.use_store = False
 
 
     
@@ -44,6 +46,11 @@ class DataHandler:
         self.data_source_folder = folder
 
 
+    # Use a columnar store of converted trials (memory-mapped .npy files next to each pickle)
+    def set_use_store(self, use_store):
+        self.use_store = use_store
+
+
     # Get the filenames of all files in a given folder
     def get_filenames(self, in_folder, save_folder=None):
         self.filepath = os.path.abspath(os.path.join(os.path.expanduser('~'),self.data_source_folder,in_folder))
@@ -93,6 +100,31 @@ class DataHandler:
         return {'topic':sep[0], 'field':sep[1]}
 
 
+    # Get the index range [start, end) of sorted timestamps that falls in a time window
+    #   pad adds extra samples on each side (e.g. to keep the window inside an interpolation)
+    def get_window(self, timestamps, t_start=None, t_end=None, pad=0):
+        start = 0
+        end = len(timestamps)
+        if t_start is not None:
+            start = max(int(np.searchsorted(timestamps, t_start, side='left'))-pad, 0)
+        if t_end is not None:
+            end = min(int(np.searchsorted(timestamps, t_end, side='right'))+pad, len(timestamps))
+        return (start, end)
+
+
+    # Get the folder of the columnar store for a trial file
+    def get_store_folder(self, in_file):
+        return os.path.splitext(in_file)[0]+'.cols'
+
+
+    # Get the store filenames of a y-field: (timestamps, data)
+    def get_store_files(self, in_file, y_field):
+        folder = self.get_store_folder(in_file)
+        field_name = y_field['topic']+'__'+y_field['field']
+        return (os.path.join(folder, y_field['topic']+'.timestamp.npy'),
+                os.path.join(folder, field_name+'.npy'))
+
+
     # Find the elements from the pickeled file structure
     def find_el(self,element, json):
         keys = element.split('.')
@@ -107,39 +139,109 @@ class DataHandler:
     #------------------------------
 
         
+    # Load the raw pickled data from a file
+    def load_raw_data(self, in_file):
+        with open(in_file,'rb') as f:
+            curr_data_raw = pickle.load(f)
+        return curr_data_raw
+
+
+    # Extract a y-field from the raw pickled data
+    #   Samples are sorted by timestamp (messages aren't always pickled in order)
+    #   so windows can be found with a binary search
+    def extract_field(self, curr_data_raw, y_field):
+        curr_topic = curr_data_raw[ y_field['topic'] ]
+
+        times = []
+        data = []
+        for msg in curr_topic:
+            list_el = self.find_el( y_field['field'], msg['msg'])
+
+            if type(list_el) != list:
+                list_el_fix = []
+                for key, value in list_el.items():
+                    list_el_fix.append(value)
+           
+            else:
+                list_el_fix = list_el
+
+            data.append(list_el_fix)
+            times.append(msg['timestamp'])
+
+        order = np.argsort(np.array(times, dtype=float), kind='mergesort')
+
+        out = dict()
+        #out['data'] = map(list, zip(*data))
+        out['data'] = [data[idx] for idx in order]
+        out['timestamp'] = [times[idx] for idx in order]
+        return out
+
+
+    # Check whether the store of a trial is missing or older than the trial for any y-field
+    def needs_conversion(self, in_file):
+        src_time = os.path.getmtime(in_file)
+        for y_field in self.y_fields:
+            for store_file in self.get_store_files(in_file, y_field):
+                if not os.path.exists(store_file) or os.path.getmtime(store_file) < src_time:
+                    return True
+        return False
+
+
+    # Convert the y-fields of a trial into its columnar store (sorted by timestamp, see "extract_field")
+    def convert_file(self, in_file):
+        curr_data_raw = self.load_raw_data(in_file)
+
+        folder = self.get_store_folder(in_file)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        for y_field in self.y_fields:
+            out = self.extract_field(curr_data_raw, y_field)
+            time_file, data_file = self.get_store_files(in_file, y_field)
+            np.save(time_file, np.array(out['timestamp'], dtype=float))
+            np.save(data_file, np.array(out['data'], dtype=float))
+
+
     # Get the data from a particular file based on the desired y-fields
-    def get_data(self,in_file):
-        filename = in_file
-        with open(filename,'r') as f:
-            if filename.endswith('.pkl'):
-                curr_data_raw = pickle.load(f)
-            f.close()
+    #   t_start, t_end: only get samples within this time window
+    def get_data(self,in_file, t_start=None, t_end=None):
+        if self.use_store:
+            return self.get_data_from_store(in_file, t_start, t_end)
+
+        curr_data_raw = self.load_raw_data(in_file)
 
         self.curr_data=dict()
 
         for i,y_field in enumerate(self.y_fields):
-            curr_topic = curr_data_raw[ y_field['topic'] ]
+            out = self.extract_field(curr_data_raw, y_field)
 
-            times = []
-            data = []
-            for msg in curr_topic:
-                list_el = self.find_el( y_field['field'], msg['msg'])
+            if (t_start is not None) or (t_end is not None):
+                start, end = self.get_window(np.array(out['timestamp']), t_start, t_end)
+                out['data'] = out['data'][start:end]
+                out['timestamp'] = out['timestamp'][start:end]
 
-                if type(list_el) != list:
-                    list_el_fix = []
-                    for key, value in list_el.iteritems():
-                        list_el_fix.append(value)
-               
-                else:
-                    list_el_fix = list_el
+            out_key = self.yfield_to_key(y_field)
+            self.curr_data[out_key] = out
+
+        return self.curr_data
+
+
+    # Get the data from the columnar store of a trial (converting it first if needed)
+    #   Timestamps are memory-mapped and binary searched, so only the window is read
+    def get_data_from_store(self, in_file, t_start=None, t_end=None):
+        if self.needs_conversion(in_file):
+            self.convert_file(in_file)
+
+        self.curr_data=dict()
 
-                data.append(list_el_fix)
-                times.append(msg['timestamp'])
+        for y_field in self.y_fields:
+            time_file, data_file = self.get_store_files(in_file, y_field)
+            times = np.load(time_file, mmap_mode='r')
+            start, end = self.get_window(times, t_start, t_end)
 
             out = dict()
-            #out['data'] = map(list, zip(*data))
-            out['data'] = data
-            out['timestamp'] = times
+            out['data'] = np.array(np.load(data_file, mmap_mode='r')[start:end])
+            out['timestamp'] = np.array(times[start:end])
 
             out_key = self.yfield_to_key(y_field)
             self.curr_data[out_key] = out
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+from __future__ import print_function
+import numpy as np
+
+
+
+# Summary pyramids store downsampled copies of a position's stats so overview
+# plots don't have to draw every sample. Each level reduces the one before it
+# by a constant factor, and stores for every stat the block mean ("<stat>"),
+# minimum ("<stat>_min") and maximum ("<stat>_max"). The mean +/- stdev band
+# is stored as its block envelope ("band_min", "band_max").
+
+
+# Reduce (T, k) arrays in blocks along the first axis
+#   kind is "mean" (weighted by the number of samples each row covers), "min" or "max"
+def _block_reduce(values, starts, counts, kind):
+    if kind == 'min':
+        return np.minimum.reduceat(values, starts, axis=0)
+    if kind == 'max':
+        return np.maximum.reduceat(values, starts, axis=0)
+
+    shape = (-1,)+(1,)*(values.ndim-1)
+    totals = np.add.reduceat(values*counts.reshape(shape), starts, axis=0)
+    return totals/np.add.reduceat(counts, starts).reshape(shape)
+
+
+# Build the downsampled levels of a set of stats (ordered fine to coarse)
+def build_pyramid(stats, factor=4, min_length=64):
+    # Start from the full resolution stats, where every sample is its own block
+    time = np.asarray(stats['timestamp'], dtype=float)
+    counts = np.ones(len(time))
+    data = {}
+    kinds = {}
+    for key in stats['data']:
+        curr = stats['data'][key]
+        data[key] = {}
+        for stat_name in curr:
+            values = np.asarray(curr[stat_name])
+            data[key][stat_name] = values
+            data[key][stat_name+'_min'] = values
+            data[key][stat_name+'_max'] = values
+            kinds[stat_name] = 'mean'
+            kinds[stat_name+'_min'] = 'min'
+            kinds[stat_name+'_max'] = 'max'
+
+        if 'mean' in curr and 'stdev' in curr:
+            data[key]['band_min'] = data[key]['mean']-data[key]['stdev']
+            data[key]['band_max'] = data[key]['mean']+data[key]['stdev']
+            kinds['band_min'] = 'min'
+            kinds['band_max'] = 'max'
+
+    # Each level reduces the one before it
+    levels = []
+    while len(time)//factor >= min_length:
+        starts = np.arange(0, len(time), factor)
+        level = {'timestamp': _block_reduce(time, starts, counts, 'mean'), 'data': {}}
+        for key in data:
+            level['data'][key] = dict((stat_name, _block_reduce(values, starts, counts, kinds[stat_name]))
+                                      for stat_name, values in data[key].items())
+
+        levels.append(level)
+        counts = np.add.reduceat(counts, starts)
+        time = level['timestamp']
+        data = level['data']
+
+    return levels
+
+
+# Pick the coarsest level that still has at least max_points samples
+#   Returns None if the full resolution stats should be used
+def select_level(levels, max_points):
+    selected = None
+    for level in levels:
+        if len(level['timestamp']) >= max_points:
+            selected = level
+    return selected
@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+from __future__ import print_function
+import numpy as np
+
+
+
+# Reducers take a stack of interpolated reps with shape (reps, T, k) and
+# return a dictionary of named (T, k) arrays to store alongside the stats.
+# Factories below return reducers so their settings can be chosen up front.
+
+
+# Mean and standard deviation (always computed by the StatGenerator)
+def mean_stdev(stack):
+    return {'mean': np.mean(stack, axis=0),
+            'stdev': np.std(stack, axis=0)}
+
+
+# Median across reps
+def median(stack):
+    return {'median': np.median(stack, axis=0)}
+
+
+# Percentile bands across reps, computed in a single pass
+def percentiles(qs=(5, 95)):
+    qs = list(qs)
+
+    def reducer(stack):
+        values = np.percentile(stack, qs, axis=0)
+        return dict(('p%02g'%(q), values[idx]) for idx, q in enumerate(qs))
+
+    return reducer
+
+
+# Bootstrap confidence interval on the mean
+#   The resampled rep indices are drawn as one (num_resamples, reps) matrix and
+#   turned into per-resample rep counts. The resampled means are then a matrix
+#   product with the flattened stack, done a batch of columns at a time (with
+#   the percentiles taken per batch) so memory stays at num_resamples*batch_size.
+def bootstrap_ci(num_resamples=1000, confidence=95, seed=None, batch_size=4096):
+    tail = (100.0 - confidence)/2.0
+
+    def reducer(stack):
+        reps = stack.shape[0]
+        flat = stack.reshape(reps, -1)
+        rng = np.random.RandomState(seed)
+
+        idx = rng.randint(0, reps, size=(num_resamples, reps))
+        offsets = reps*np.arange(num_resamples)[:, None]
+        counts = np.bincount((idx + offsets).ravel(), minlength=num_resamples*reps)
+        weights = counts.reshape(num_resamples, reps)/float(reps)
+
+        lower = np.empty(flat.shape[1])
+        upper = np.empty(flat.shape[1])
+        for start in range(0, flat.shape[1], batch_size):
+            boot_means = np.dot(weights, flat[:, start:start+batch_size])
+            lower[start:start+batch_size], upper[start:start+batch_size] = np.percentile(boot_means, [tail, 100.0-tail], axis=0)
+
+        return {'ci_lower': lower.reshape(stack.shape[1:]),
+                'ci_upper': upper.reshape(stack.shape[1:])}
+
+    return reducer
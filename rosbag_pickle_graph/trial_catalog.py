@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+from __future__ import print_function
+import os
+import numpy as np
+
+
+
+# Compact catalog of sorted trial files
+#   Each trial is a row of categorical codes (bin, folder) plus its position
+#   number and file name. Bins and folders are stored once, so large data sets
+#   don't repeat long path strings, and grouping by (bin, position) is a sort
+#   over integer arrays.
+class TrialCatalog:
+    def __init__(self):
+        self.bins = []
+        self.folders = []
+        self.summary_files = []
+        self.summary_exists = []
+        self.subset = False
+        self.data_set = None
+        self.source_base_dir = None
+
+        self._bin_lookup = {}
+        self._folder_lookup = {}
+        self._bin_codes = []
+        self._folder_codes = []
+        self._positions = []
+        self._names = []
+        self._arrays = None
+        self._groups = None
+
+
+
+    # HELPERS
+    #------------------------------
+
+    # Get the code of a category, adding it if it's new
+    def _get_code(self, value, categories, lookup):
+        code = lookup.get(value, None)
+        if code is None:
+            code = len(categories)
+            categories.append(value)
+            lookup[value] = code
+        return code
+
+
+    # Get the columns as arrays
+    def _get_arrays(self):
+        if self._arrays is None:
+            self._arrays = {'bin_codes': np.array(self._bin_codes, dtype=np.int32),
+                            'folder_codes': np.array(self._folder_codes, dtype=np.int32),
+                            'positions': np.array(self._positions, dtype=np.int32)}
+        return self._arrays
+
+
+    # Group the rows by bin and position: {bin_code: [(pos_num, rows), ...]}
+    def _get_groups(self):
+        if self._groups is None:
+            arrays = self._get_arrays()
+            bin_codes = arrays['bin_codes']
+            positions = arrays['positions']
+
+            order = np.lexsort((positions, bin_codes))
+            if len(order)>0:
+                change = np.flatnonzero((np.diff(bin_codes[order]) != 0) | (np.diff(positions[order]) != 0))+1
+                splits = np.split(order, change)
+            else:
+                splits = []
+
+            self._groups = {}
+            for rows in splits:
+                bin_code = int(bin_codes[rows[0]])
+                self._groups.setdefault(bin_code, []).append((int(positions[rows[0]]), rows))
+        return self._groups
+
+
+    # Get the full path of a row
+    def _get_path(self, row):
+        return os.path.join(self.folders[self._folder_codes[row]], self._names[row])
+
+
+
+    # DO WORK
+    #------------------------------
+
+    # Add a trial file to the catalog
+    #   The summary file of a bin is the one given with its most recently added trial
+    def add(self, full_file, bin_key, pos_num, summary_file, summary_exists):
+        bin_code = self._get_code(bin_key, self.bins, self._bin_lookup)
+        if bin_code == len(self.summary_files):
+            self.summary_files.append(summary_file)
+            self.summary_exists.append(summary_exists)
+        else:
+            self.summary_files[bin_code] = summary_file
+            self.summary_exists[bin_code] = summary_exists
+
+        folder, name = os.path.split(full_file)
+        self._bin_codes.append(bin_code)
+        self._folder_codes.append(self._get_code(folder, self.folders, self._folder_lookup))
+        self._positions.append(pos_num)
+        self._names.append(name)
+        self._arrays = None
+        self._groups = None
+
+
+    # Get the number of trials in the catalog
+    def __len__(self):
+        return len(self._names)
+
+
+    # Get the summary metadata of a bin
+    def get_meta(self, bin_key):
+        bin_code = self._bin_lookup[bin_key]
+        return {'summary_file': self.summary_files[bin_code],
+                'summary_exists': self.summary_exists[bin_code]}
+
+
+    # Get the positions in a bin with their files: [(pos_num, [files]), ...]
+    def get_positions(self, bin_key):
+        groups = self._get_groups().get(self._bin_lookup[bin_key], [])
+        return [(pos_num, [self._get_path(row) for row in rows]) for pos_num, rows in groups]
+
+
+    # Re-check which bins already have summary files on disk
+    def refresh_summaries(self):
+        self.summary_exists = [os.path.exists(summary_file) for summary_file in self.summary_files]
+
+
+    # Save the catalog to a file (numpy .npz)
+    def save(self, filename):
+        arrays = self._get_arrays()
+        with open(filename,'wb') as f:
+            np.savez(f,
+                     bins = np.array(self.bins, dtype=np.str_),
+                     folders = np.array(self.folders, dtype=np.str_),
+                     summary_files = np.array(self.summary_files, dtype=np.str_),
+                     summary_exists = np.array(self.summary_exists, dtype=bool),
+                     names = np.array(self._names, dtype=np.str_),
+                     subset = np.array(self.subset, dtype=bool),
+                     data_set = np.array(self.data_set or '', dtype=np.str_),
+                     source_base_dir = np.array(self.source_base_dir or '', dtype=np.str_),
+                     **arrays)
+
+
+    # Load a catalog from a file
+    @classmethod
+    def load(cls, filename):
+        catalog = cls()
+        with np.load(filename, allow_pickle=False) as saved:
+            catalog.bins = [str(value) for value in saved['bins']]
+            catalog.folders = [str(value) for value in saved['folders']]
+            catalog.summary_files = [str(value) for value in saved['summary_files']]
+            catalog.summary_exists = [bool(value) for value in saved['summary_exists']]
+            catalog._names = [str(value) for value in saved['names']]
+            catalog._bin_codes = saved['bin_codes'].tolist()
+            catalog._folder_codes = saved['folder_codes'].tolist()
+            catalog._positions = saved['positions'].tolist()
+            catalog.subset = bool(saved['subset']) if 'subset' in saved else False
+            catalog.data_set = str(saved['data_set']) or None
+            catalog.source_base_dir = str(saved['source_base_dir']) or None
+
+        catalog._bin_lookup = dict((value, code) for code, value in enumerate(catalog.bins))
+        catalog._folder_lookup = dict((value, code) for code, value in enumerate(catalog.folders))
+        return catalog
@@ -0,0 +1,235 @@
+#! /usr/bin/env python
+from __future__ import print_function
+import os
+import re
+import csv
+import json
+import sqlite3
+
+
+
+# Keep a small SQLite index of trial metadata so subsets can be selected
+# without unpickling every trial
+class TrialIndex:
+    def __init__(self, filename=':memory:'):
+        self.filename = filename
+        self.success_filename = 'success.suc'
+        self.rep_regex = re.compile(r'(.+)_(\d+)$')
+
+        self.conn = sqlite3.connect(self.filename)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS trials (
+                                 path          TEXT PRIMARY KEY,
+                                 mtime         REAL,
+                                 bin           TEXT,
+                                 position      INTEGER,
+                                 success       INTEGER,
+                                 duration      REAL,
+                                 topics        TEXT,
+                                 sample_counts TEXT)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS trials_bin ON trials (bin, position)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+
+
+    # HELPERS
+    #------------------------------
+
+    # Read the success file in a trial folder: {(trial_name, rep): success}
+    def read_success_file(self, folder):
+        success = {}
+        success_file = os.path.join(folder, self.success_filename)
+        if not os.path.exists(success_file):
+            return success
+
+        with open(success_file,'r') as f:
+            for row in csv.DictReader(f):
+                try:
+                    success[(row['Trial Name'], int(row['Rep']))] = int(row['Success'])
+                except (KeyError, ValueError, TypeError):
+                    continue
+        return success
+
+
+    # Look up the success flag of a trial file from its folder's success entries
+    def get_success(self, full_file, success_entries):
+        name = os.path.splitext(os.path.basename(full_file))[0]
+        match = self.rep_regex.match(name)
+        if match is None:
+            return None
+        return success_entries.get((match.group(1), int(match.group(2))), None)
+
+
+    # Summarize the raw pickled data of a trial
+    def summarize_raw_data(self, raw_data):
+        sample_counts = {}
+        min_time = None
+        max_time = None
+        for topic in raw_data:
+            msgs = raw_data[topic]
+            if not isinstance(msgs, list):
+                continue
+
+            sample_counts[topic] = len(msgs)
+            stamps = [msg['timestamp'] for msg in msgs if isinstance(msg, dict) and 'timestamp' in msg]
+            if len(stamps)>0:
+                min_time = min(stamps) if min_time is None else min(min_time, min(stamps))
+                max_time = max(stamps) if max_time is None else max(max_time, max(stamps))
+
+        duration = None
+        if min_time is not None:
+            duration = max_time-min_time
+
+        return {'topics': sorted(sample_counts.keys()),
+                'sample_counts': sample_counts,
+                'duration': duration}
+
+
+
+    # DO WORK
+    #------------------------------
+
+    # Check whether a trial file is missing from the index or has changed on disk
+    def needs_update(self, full_file):
+        row = self.conn.execute("SELECT mtime FROM trials WHERE path=?", (full_file,)).fetchone()
+        return row is None or row[0] != os.path.getmtime(full_file)
+
+
+    # Add (or replace) a trial in the index
+    def add_trial(self, full_file, bin_key, position, success=None, summary=None, commit=True):
+        if summary is None:
+            summary = {'topics': [], 'sample_counts': {}, 'duration': None}
+
+        self.conn.execute("INSERT OR REPLACE INTO trials VALUES (?,?,?,?,?,?,?,?)",
+                          (full_file,
+                           os.path.getmtime(full_file),
+                           bin_key,
+                           position,
+                           success,
+                           summary['duration'],
+                           ','.join(summary['topics']),
+                           json.dumps(summary['sample_counts'])))
+        if commit:
+            self.conn.commit()
+
+
+    # Update the bin and position of a trial already in the index
+    def set_group(self, full_file, bin_key, position, commit=True):
+        self.conn.execute("UPDATE trials SET bin=?, position=? WHERE path=?", (bin_key, position, full_file))
+        if commit:
+            self.conn.commit()
+
+
+    # Drop a trial from the index
+    def remove_trial(self, full_file, commit=True):
+        self.conn.execute("DELETE FROM trials WHERE path=?", (full_file,))
+        if commit:
+            self.conn.commit()
+
+
+    # Get a setting the index was built with (e.g. its sort terms), or None if it isn't set
+    def get_setting(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+
+    # Store a setting the index was built with
+    def set_setting(self, key, value, commit=True):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?,?)", (key, json.dumps(value)))
+        if commit:
+            self.conn.commit()
+
+
+    # Update the success flag of a trial already in the index
+    def set_success(self, full_file, success, commit=True):
+        self.conn.execute("UPDATE trials SET success=? WHERE path=?", (success, full_file))
+        if commit:
+            self.conn.commit()
+
+
+    # Drop trials whose files no longer exist
+    def remove_missing(self):
+        paths = [row[0] for row in self.conn.execute("SELECT path FROM trials")]
+        missing = [(path,) for path in paths if not os.path.exists(path)]
+        self.conn.executemany("DELETE FROM trials WHERE path=?", missing)
+        self.conn.commit()
+        return len(missing)
+
+
+    def commit(self):
+        self.conn.commit()
+
+
+    def close(self):
+        self.conn.close()
+
+
+    # Select trials from the index
+    #   bins:      list of exact bin keys ("obj;grasp")
+    #   terms:     list of substrings that must all appear in the bin key
+    #   positions: list of position numbers
+    #   success:   True for successful trials only, False for failed trials only
+    #   topics:    list of topics the trial must contain
+    def query(self, bins=None, terms=None, positions=None, success=None,
+              topics=None, min_duration=None, max_duration=None):
+        clauses = []
+        args = []
+
+        if bins is not None:
+            clauses.append("bin IN (%s)"%(','.join('?'*len(bins))))
+            args.extend(bins)
+
+        if terms is not None:
+            for term in terms:
+                clauses.append("instr(bin, ?) > 0")
+                args.append(term)
+
+        if positions is not None:
+            clauses.append("position IN (%s)"%(','.join('?'*len(positions))))
+            args.extend(positions)
+
+        if success is True:
+            clauses.append("success > 0")
+        elif success is False:
+            clauses.append("success = 0")
+
+        if min_duration is not None:
+            clauses.append("duration >= ?")
+            args.append(min_duration)
+
+        if max_duration is not None:
+            clauses.append("duration <= ?")
+            args.append(max_duration)
+
+        sql = "SELECT path, topics FROM trials"
+        if len(clauses)>0:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY bin, position, path"
+
+        paths = []
+        for path, trial_topics in self.conn.execute(sql, args):
+            if topics is not None:
+                trial_topics = trial_topics.split(',')
+                if not all(topic in trial_topics for topic in topics):
+                    continue
+            paths.append(path)
+
+        return paths
+
+
+    # Get the full metadata record of a trial
+    def get_trial(self, full_file):
+        row = self.conn.execute("SELECT * FROM trials WHERE path=?", (full_file,)).fetchone()
+        if row is None:
+            return None
+
+        return {'path': row[0],
+                'mtime': row[1],
+                'bin': row[2],
+                'position': row[3],
+                'success': row[4],
+                'duration': row[5],
+                'topics': row[6].split(',') if row[6] else [],
+                'sample_counts': json.loads(row[7])}
@@ -0,0 +1,224 @@
+#! /usr/bin/env python
+from __future__ import print_function
+import os
+import re
+import time
+import matplotlib.pyplot as plt
+
+
+
+# Watch a data set for new trials and incrementally update stats and plots
+#   Uses a StatGenerator for its settings (source, destination, fields, flags).
+#   Only newly completed trials are parsed; the stats and figures of the
+#   affected bin and position are then recalculated from cached trial data.
+#   Summary files of affected folders are removed so batch runs recalculate them.
+#   Figures are rendered without being shown so watching never blocks on a window.
+class TrialWatcher:
+    def __init__(self, stat_gen, sort_terms, trial_regex=r'pos_(\d+)_'):
+        self.stat = stat_gen
+        self.sort_terms = sort_terms
+        self.match_pos = re.compile(trial_regex)
+        self.poll_interval = 2.0
+        self.save = True
+
+        self.known_files = {}
+        self.pending = {}
+        self.startup_files = set()
+        self.trial_data = {}
+        self.trial_groups = {}
+        self.allstats = {}
+        self.stat.get_graph_handler().set_fig_props(show=False)
+
+        # Files already on disk still have to pass the completeness check, but
+        # once complete they are only parsed when a new trial lands in the
+        # same bin and position.
+        files = self._scan()
+        self.pending.update(files)
+        self.startup_files.update(files.keys())
+
+
+
+    # SETUP FUNCTIONS
+    #------------------------------
+
+    # Set how often to check for new trials (in seconds)
+    def set_poll_interval(self, poll_interval):
+        self.poll_interval = poll_interval
+
+
+    # Set whether to save updated figures
+    def set_save(self, save):
+        self.save = save
+
+
+
+    # HELPERS
+    #------------------------------
+
+    # Get the size and modification time of all trial files in the data set
+    def _scan(self):
+        files = {}
+        data_set_dir = os.path.join(self.stat.source_base_dir, self.stat.data_set)
+        for root, full_file in self.stat._get_files_recursively(data_set_dir, self.stat.file_extension):
+            file_stat = self._get_file_stat(full_file)
+            if file_stat is not None:
+                files[full_file] = file_stat
+        return files
+
+
+    # Get the size and modification time of a file, or None if it's gone
+    def _get_file_stat(self, full_file):
+        try:
+            stat_res = os.stat(full_file)
+        except OSError:
+            return None
+        return (stat_res.st_size, stat_res.st_mtime)
+
+
+    # Get the bin key and position of a trial file, or (None, None) if it isn't part of the set
+    def _get_bin_pos(self, full_file):
+        bin_key = self.stat._get_bin_key(os.path.basename(os.path.dirname(full_file)), self.sort_terms)
+        pos_match = self.match_pos.search(os.path.basename(full_file))
+        if bin_key is None or pos_match is None:
+            return (None, None)
+        return (bin_key, int(pos_match.group(1)))
+
+
+    # Parse a trial file into the cache
+    def _load_trial(self, full_file):
+        self.trial_data[full_file] = self.stat.dh.get_data(full_file)
+
+
+    # Get all cached trial data in a bin and position, in the "get_raw_data" format
+    def _get_raw_data(self, bin_key, pos_num):
+        data_out = {}
+        for full_file in sorted(self.trial_groups[(bin_key, pos_num)]):
+            curr_data = self.trial_data[full_file]
+            for key in curr_data:
+                if data_out.get(key,None) is None:
+                    data_out[key] = []
+                data_out[key].append(curr_data[key])
+        return data_out
+
+
+
+    # DO WORK
+    #------------------------------
+
+    # Check for new or changed trial files that have stopped changing since the last poll,
+    # and for trial files that have been removed
+    def poll(self):
+        files = self._scan()
+        completed = []
+        for full_file in files:
+            if self.known_files.get(full_file, None) == files[full_file]:
+                continue
+
+            # A file is complete once its size and time match between polls
+            if self.pending.get(full_file, None) == files[full_file]:
+                del self.pending[full_file]
+                self.known_files[full_file] = files[full_file]
+                if full_file in self.startup_files:
+                    self.startup_files.discard(full_file)
+                else:
+                    completed.append(full_file)
+            else:
+                # Files that change after startup get processed like new ones
+                self.pending[full_file] = files[full_file]
+                self.startup_files.discard(full_file)
+
+        for full_file in list(self.pending):
+            if full_file not in files:
+                del self.pending[full_file]
+                self.startup_files.discard(full_file)
+
+        for full_file in list(self.known_files):
+            if full_file not in files:
+                completed.append(full_file)
+
+        return sorted(completed)
+
+
+    # Parse new trials, drop removed ones, and update the stats and plots of the affected bins and positions
+    def process(self, new_files):
+        affected = set()
+        for full_file in new_files:
+            removed = not os.path.exists(full_file)
+            if removed:
+                self.known_files.pop(full_file, None)
+            elif full_file not in self.known_files:
+                self.known_files[full_file] = self._get_file_stat(full_file)
+            bin_key, pos_num = self._get_bin_pos(full_file)
+            if bin_key is None:
+                continue
+
+            # Load trials already on disk the first time a position is touched
+            group = (bin_key, pos_num)
+            if group not in self.trial_groups:
+                self.trial_groups[group] = set()
+                for old_file in self.known_files:
+                    if old_file != full_file and self._get_bin_pos(old_file) == group:
+                        self._load_trial(old_file)
+                        self.trial_groups[group].add(old_file)
+
+            if removed:
+                print('Removed trial: %s'%(full_file))
+                self.trial_groups[group].discard(full_file)
+                self.trial_data.pop(full_file, None)
+            else:
+                print('New trial: %s'%(full_file))
+                self._load_trial(full_file)
+                self.trial_groups[group].add(full_file)
+            affected.add(group)
+
+            # The folder's summary no longer matches its trials
+            summary_file = os.path.join(os.path.dirname(full_file), 'summary.stat')
+            if os.path.exists(summary_file):
+                print('Removing outdated summary: %s'%(summary_file))
+                os.remove(summary_file)
+
+        for bin_key, pos_num in sorted(affected):
+            # Positions without trials left have no stats
+            if len(self.trial_groups[(bin_key, pos_num)]) == 0:
+                print('No trials left: %s, Position: %s'%(bin_key, pos_num))
+                del self.trial_groups[(bin_key, pos_num)]
+                self.allstats.get(bin_key, {}).pop(pos_num, None)
+                if self.allstats.get(bin_key, None) == {}:
+                    del self.allstats[bin_key]
+                continue
+
+            print('Updating: %s, Position: %s'%(bin_key, pos_num))
+            stats = self.stat.calculate_stats(self._get_raw_data(bin_key, pos_num))
+            stats['out_file'] = self.stat._get_out_file_group(bin_key, pos_num)
+
+            if self.allstats.get(bin_key, None) is None:
+                self.allstats[bin_key] = {}
+            self.allstats[bin_key][pos_num] = stats
+
+            if self.stat.plot_means:
+                graph = self.stat.get_graph_handler()
+                if self.save:
+                    graph.plot_stats(stats, save_loc = stats['out_file'])
+                else:
+                    graph.plot_stats(stats)
+                plt.close(graph.fig)
+
+        self.stat.allstats = self.allstats
+        return sorted(affected)
+
+
+    # Poll for new trials until stopped (or for a set number of polls)
+    def run(self, max_polls=None):
+        num_polls = 0
+        print('Watching: %s'%(os.path.join(self.stat.source_base_dir, self.stat.data_set)))
+        try:
+            while max_polls is None or num_polls < max_polls:
+                new_files = self.poll()
+                if len(new_files)>0:
+                    self.process(new_files)
+                num_polls+=1
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print('Stopped watching')
+
+        return self.allstats
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from rosbag_pickle_graph import StatGenerator
+from rosbag_pickle_graph import align_reps
+
+
+def _make_runs(shifts, offsets):
+    runs = []
+    for shift, offset in zip(shifts, offsets):
+        stamps = np.arange(0, 10, 0.01) + offset
+        force = np.exp(-((stamps-4-shift)**2)*4)
+        runs.append({'timestamp': stamps, 'data': np.column_stack([force, 0*force])})
+    return runs
+
+
+def test_estimate_lags_recovers_known_shifts():
+    shifts = np.array([0, 0.5, -0.3, 1.2])
+    runs = _make_runs(shifts, offsets=[0, 0.37, 0.74, 1.11])
+    lags = align_reps.estimate_lags(runs, max_lag=3)
+    assert np.allclose(lags, shifts, atol=0.011)
+
+
+def test_estimate_lags_max_lag_includes_start_offsets():
+    # Same absolute pulse, but the second rep starts recording 1s later
+    runs = []
+    for start in [0, 1.0]:
+        stamps = np.arange(start, 10, 0.01)
+        runs.append({'timestamp': stamps, 'data': np.exp(-((stamps-4)**2)*4)[:, None]})
+    lags = align_reps.estimate_lags(runs, max_lag=0.5)
+    assert np.allclose(lags, 0, atol=0.011)
+
+    shifts = np.array([0, 0.2, -0.3])
+    lags = align_reps.estimate_lags(_make_runs(shifts, offsets=[0, 0.8, 1.5]), max_lag=0.5)
+    assert np.allclose(lags, shifts, atol=0.011)
+
+
+def test_estimate_lags_repeated_timestamps():
+    shifts = np.array([0, 0.4])
+    runs = _make_runs(shifts, offsets=[0, 0])
+    for run in runs:
+        run['timestamp'] = np.repeat(run['timestamp'][::2], 2)
+    lags = align_reps.estimate_lags(runs, max_lag=1)
+    assert np.allclose(lags, shifts, atol=0.021)
+
+    stuck = [{'timestamp': np.zeros(5), 'data': np.ones(5)} for idx in range(2)]
+    with pytest.raises(ValueError):
+        align_reps.estimate_lags(stuck)
+
+
+def test_estimate_lags_onset_of_steps():
+    shifts = np.array([0, 0.8, 0.25])
+    runs = []
+    for shift in shifts:
+        stamps = np.arange(0, 10, 0.01)
+        force = 1/(1+np.exp(-(stamps-4-shift)*8))
+        runs.append({'timestamp': stamps, 'data': force[:, None]})
+    lags = align_reps.estimate_lags(runs, onset=True)
+    assert np.allclose(lags, shifts, atol=0.011)
+
+
+def test_apply_lags_keeps_first_rep_timeline():
+    runs = _make_runs([0, 0.5], offsets=[0, 0])
+    data = align_reps.apply_lags({'wrench;wrench.force': runs}, np.array([0, 0.5]))
+    aligned = data['wrench;wrench.force']
+    assert np.allclose(aligned[0]['timestamp'], runs[0]['timestamp'])
+    assert np.allclose(aligned[1]['timestamp'], runs[1]['timestamp']-0.5)
+
+
+def test_summary_alignment_check():
+    stat = StatGenerator()
+    stat.set_alignment({'topic': 'wrench', 'field': 'wrench.force'}, max_lag=1.0)
+    runs = _make_runs([0, 0.5], offsets=[0, 0])
+    stats = {'meta': {}, 0: stat.calculate_stats({'wrench;wrench.force': runs})}
+    assert np.allclose(stats[0]['lags'], [0, 0.5], atol=0.011)
+    assert stat._has_alignment(stats)
+
+    stat.set_alignment({'topic': 'wrench', 'field': 'wrench.force'}, max_lag=2.0)
+    assert not stat._has_alignment(stats)
+    stat.set_alignment(None)
+    assert not stat._has_alignment(stats)
+    assert stat._has_alignment({'meta': {}, 0: {'data': {}}})
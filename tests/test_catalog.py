@@ -0,0 +1,41 @@
+import os
+
+from rosbag_pickle_graph.trial_catalog import TrialCatalog
+
+
+def test_catalog_round_trip(tmp_path):
+    catalog = TrialCatalog()
+    catalog.data_set = 'test'
+    catalog.source_base_dir = '/data'
+    for folder, bin_key in [('/data/test/top_grasp_sphere', 'sphere;top_grasp'),
+                            ('/data/test/plop_grasp_branch4_90', 'branch4_90;plop_grasp')]:
+        for pos_num in [1, 0]:
+            for rep in range(3):
+                catalog.add(os.path.join(folder, 'pos_%04d_planned_%d.pkl'%(pos_num, rep)),
+                            bin_key, pos_num, os.path.join(folder, 'summary.stat'), False)
+
+    filename = str(tmp_path / 'catalog.npz')
+    catalog.save(filename)
+    loaded = TrialCatalog.load(filename)
+
+    assert len(loaded) == len(catalog) == 12
+    assert loaded.bins == catalog.bins
+    assert loaded.data_set == 'test'
+    assert loaded.source_base_dir == '/data'
+    assert not loaded.subset
+    for bin_key in catalog.bins:
+        assert loaded.get_meta(bin_key) == catalog.get_meta(bin_key)
+        assert loaded.get_positions(bin_key) == catalog.get_positions(bin_key)
+
+
+def test_catalog_groups_by_bin_and_position():
+    catalog = TrialCatalog()
+    catalog.add('/d/a/pos_0001_x_0.pkl', 'a', 1, '/d/a/summary.stat', False)
+    catalog.add('/d/b/pos_0000_x_0.pkl', 'b', 0, '/d/b/summary.stat', False)
+    catalog.add('/d/a/pos_0000_x_0.pkl', 'a', 0, '/d/a/summary.stat', False)
+    catalog.add('/d/a/pos_0001_x_1.pkl', 'a', 1, '/d/a/summary.stat', True)
+
+    assert catalog.get_positions('a') == [(0, ['/d/a/pos_0000_x_0.pkl']),
+                                          (1, ['/d/a/pos_0001_x_0.pkl', '/d/a/pos_0001_x_1.pkl'])]
+    assert catalog.get_meta('a')['summary_exists']
+    assert catalog.get_positions('b') == [(0, ['/d/b/pos_0000_x_0.pkl'])]
@@ -0,0 +1,99 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from rosbag_pickle_graph import StatGenerator
+from rosbag_pickle_graph.handle_data import DataHandler
+
+
+Y_FIELDS = [{'topic': 'wrench', 'field': 'wrench.force'}]
+KEY = 'wrench;wrench.force'
+
+
+# Write a trial whose messages are pickled out of order, with force = (t+offset, 0, 1)
+def _write_trial(filename, offset=0.0, num_samples=100, seed=0):
+    stamps = np.arange(num_samples)*0.01
+    order = np.random.RandomState(seed).permutation(num_samples)
+    raw = {'wrench': [{'timestamp': stamps[idx],
+                       'msg': {'wrench': {'force': {'x': stamps[idx]+offset, 'y': 0.0, 'z': 1.0}}}}
+                      for idx in order]}
+    with open(filename, 'wb') as f:
+        pickle.dump(raw, f)
+
+
+def _make_handler(use_store=False):
+    dh = DataHandler()
+    dh.set_yfields(Y_FIELDS)
+    dh.set_use_store(use_store)
+    return dh
+
+
+def test_get_window_edges():
+    dh = DataHandler()
+    times = np.arange(10)*1.0
+    assert dh.get_window(times) == (0, 10)
+    assert dh.get_window(times, 2.0, 5.0) == (2, 6)
+    assert dh.get_window(times, 2.5, 4.5) == (3, 5)
+    assert dh.get_window(times, 2.5, 4.5, pad=1) == (2, 6)
+    assert dh.get_window(times, -5.0, 0.0, pad=3) == (0, 4)
+    assert dh.get_window(times, None, 3.0) == (0, 4)
+    assert dh.get_window(times, 8.5, None, pad=2) == (7, 10)
+
+    start, end = dh.get_window(times, 20.0, 30.0)
+    assert start == end == 10
+
+
+def test_extract_field_sorts_samples(tmp_path):
+    filename = str(tmp_path / 'pos_0000_planned_0.pkl')
+    _write_trial(filename)
+    data = _make_handler().get_data(filename)[KEY]
+
+    times = np.array(data['timestamp'])
+    assert np.all(np.diff(times) > 0)
+    assert np.allclose(np.array(data['data']), np.column_stack([times, 0*times, 1+0*times]))
+
+
+def test_store_conversion_and_windows(tmp_path):
+    filename = str(tmp_path / 'pos_0000_planned_0.pkl')
+    _write_trial(filename)
+    dh = _make_handler(use_store=True)
+
+    assert dh.needs_conversion(filename)
+    dh.convert_file(filename)
+    assert not dh.needs_conversion(filename)
+
+    time_file, data_file = dh.get_store_files(filename, Y_FIELDS[0])
+    assert np.all(np.diff(np.load(time_file)) > 0)
+
+    store_data = dh.get_data(filename, t_start=0.25, t_end=0.5)[KEY]
+    plain_data = _make_handler().get_data(filename, t_start=0.25, t_end=0.5)[KEY]
+    assert np.allclose(store_data['timestamp'], plain_data['timestamp'])
+    assert np.allclose(store_data['data'], plain_data['data'])
+    assert np.isclose(store_data['timestamp'][0], 0.25)
+    assert np.isclose(store_data['timestamp'][-1], 0.5)
+
+    # Rewriting the trial makes its store outdated
+    src_time = os.path.getmtime(time_file)+10
+    os.utime(filename, (src_time, src_time))
+    assert dh.needs_conversion(filename)
+
+
+def test_windowed_calculate_stats(tmp_path):
+    stat = StatGenerator()
+    stat.set_yfields(Y_FIELDS)
+    data = {KEY: []}
+    for rep in range(3):
+        filename = str(tmp_path / ('pos_0000_planned_%d.pkl'%(rep)))
+        _write_trial(filename, offset=rep, seed=rep)
+        data[KEY].append(stat.dh.get_data(filename)[KEY])
+
+    stats = stat.calculate_stats(data, t_start=0.2, t_end=0.6)
+    times = stats['timestamp']
+    assert times[0] >= 0.2 and times[-1] <= 0.6
+    assert np.allclose(stats['data'][KEY]['mean'][:, 0], times+1)
+    assert np.allclose(stats['data'][KEY]['stdev'][:, 0], np.std([0, 1, 2]))
+
+    with pytest.raises(ValueError):
+        stat.calculate_stats(data, t_start=5.0, t_end=6.0)
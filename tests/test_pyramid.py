@@ -0,0 +1,54 @@
+import numpy as np
+
+from rosbag_pickle_graph import stat_pyramid
+
+
+def _make_stats(length=1000, seed=0):
+    rng = np.random.RandomState(seed)
+    return {'timestamp': np.arange(length)*0.01,
+            'data': {'wrench;wrench.force': {'mean': rng.randn(length, 3),
+                                             'stdev': rng.rand(length, 3)}}}
+
+
+# Reduce full resolution values into blocks of "size" samples (the last block may be short)
+def _reduce_full(values, size, fun):
+    return np.array([fun(values[start:start+size], axis=0) for start in range(0, len(values), size)])
+
+
+def test_level_lengths():
+    levels = stat_pyramid.build_pyramid(_make_stats(1000), factor=4, min_length=10)
+    lengths = [len(level['timestamp']) for level in levels]
+    assert lengths == [250, 63, 16]
+    for level in levels:
+        for values in level['data']['wrench;wrench.force'].values():
+            assert len(values) == len(level['timestamp'])
+
+    assert stat_pyramid.build_pyramid(_make_stats(100), factor=4, min_length=64) == []
+
+
+def test_weighted_means_and_envelopes():
+    stats = _make_stats(1003)
+    levels = stat_pyramid.build_pyramid(stats, factor=4, min_length=10)
+    mean = stats['data']['wrench;wrench.force']['mean']
+    stdev = stats['data']['wrench;wrench.force']['stdev']
+
+    # Every level matches reducing the full resolution stats directly, including the ragged last blocks
+    for idx, level in enumerate(levels):
+        size = 4**(idx+1)
+        level_data = level['data']['wrench;wrench.force']
+        assert np.allclose(level['timestamp'], _reduce_full(stats['timestamp'], size, np.mean))
+        assert np.allclose(level_data['mean'], _reduce_full(mean, size, np.mean))
+        assert np.allclose(level_data['mean_min'], _reduce_full(mean, size, np.min))
+        assert np.allclose(level_data['mean_max'], _reduce_full(mean, size, np.max))
+        assert np.allclose(level_data['stdev'], _reduce_full(stdev, size, np.mean))
+        assert np.allclose(level_data['band_min'], _reduce_full(mean-stdev, size, np.min))
+        assert np.allclose(level_data['band_max'], _reduce_full(mean+stdev, size, np.max))
+
+
+def test_select_level():
+    levels = stat_pyramid.build_pyramid(_make_stats(1000), factor=4, min_length=10)
+    assert stat_pyramid.select_level(levels, 16) is levels[2]
+    assert stat_pyramid.select_level(levels, 17) is levels[1]
+    assert stat_pyramid.select_level(levels, 250) is levels[0]
+    assert stat_pyramid.select_level(levels, 251) is None
+    assert stat_pyramid.select_level([], 10) is None
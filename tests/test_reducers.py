@@ -0,0 +1,24 @@
+import numpy as np
+
+from rosbag_pickle_graph import stat_reducers
+
+
+def test_percentiles_match_numpy():
+    stack = np.random.RandomState(0).normal(size=(7, 20, 3))
+    out = stat_reducers.percentiles((5, 95))(stack)
+    assert np.allclose(out['p05'], np.percentile(stack, 5, axis=0))
+    assert np.allclose(out['p95'], np.percentile(stack, 95, axis=0))
+
+
+def test_bootstrap_ci_matches_looped_reference():
+    stack = np.random.RandomState(1).normal(size=(6, 15, 2))
+    num_resamples = 300
+    out = stat_reducers.bootstrap_ci(num_resamples, confidence=90, seed=3, batch_size=7)(stack)
+
+    # Draw the same index matrix and resample one row at a time
+    idx = np.random.RandomState(3).randint(0, stack.shape[0], size=(num_resamples, stack.shape[0]))
+    boot_means = np.array([np.mean(stack[row], axis=0) for row in idx])
+    lower, upper = np.percentile(boot_means, [5, 95], axis=0)
+
+    assert np.allclose(out['ci_lower'], lower)
+    assert np.allclose(out['ci_upper'], upper)
@@ -0,0 +1,79 @@
+import os
+import pickle
+import shutil
+
+from rosbag_pickle_graph import StatGenerator
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data', 'top_grasp_2_sphere_20200316_203800')
+
+
+# Copy the test success file into a data set with a few synthetic trials
+def _make_data_set(tmp_path, num_reps=5):
+    folder = tmp_path / 'test_set' / 'top_grasp_2_sphere_20200316_203800'
+    folder.mkdir(parents=True)
+    shutil.copy(os.path.join(DATA_DIR, 'success.suc'), str(folder / 'success.suc'))
+    for rep in range(num_reps):
+        raw = {'wrench': [{'timestamp': 0.1*idx, 'wrench': {'force': [0.0, 0.0, idx]}} for idx in range(10+rep)],
+               'joint_states': [{'timestamp': 0.2*idx, 'position': [idx]} for idx in range(5)]}
+        with open(str(folder / ('pos_0000_planned_%d.pkl'%(rep))), 'wb') as f:
+            pickle.dump(raw, f)
+    return folder
+
+
+def _make_stat_gen(tmp_path):
+    stat = StatGenerator()
+    stat.set_source(str(tmp_path))
+    stat.get_filenames('test_set')
+    stat.set_index(str(tmp_path / 'index.db'))
+    return stat
+
+
+def test_success_file_parsing(tmp_path):
+    folder = _make_data_set(tmp_path)
+    stat = _make_stat_gen(tmp_path)
+
+    entries = stat.index.read_success_file(str(folder))
+    assert entries == {('pos_0000_planned', 0): 4,
+                       ('pos_0000_planned', 1): 0,
+                       ('pos_0000_planned', 2): 3,
+                       ('pos_0000_planned', 3): 0,
+                       ('pos_0000_planned', 4): 4}
+    assert stat.index.get_success(str(folder / 'pos_0000_planned_2.pkl'), entries) == 3
+    assert stat.index.get_success(str(folder / 'pos_0000_planned_9.pkl'), entries) is None
+
+
+def test_query_filters(tmp_path):
+    folder = _make_data_set(tmp_path)
+    stat = _make_stat_gen(tmp_path)
+    stat.update_index([['sphere'], ['top_grasp']])
+
+    files = [str(folder / ('pos_0000_planned_%d.pkl'%(rep))) for rep in range(5)]
+    assert stat.index.query() == files
+    assert stat.index.query(success=True) == [files[0], files[2], files[4]]
+    assert stat.index.query(success=False) == [files[1], files[3]]
+    assert stat.index.query(bins=['sphere;top_grasp'], positions=[0]) == files
+    assert stat.index.query(positions=[1]) == []
+    assert stat.index.query(terms=['sph', 'top']) == files
+    assert stat.index.query(terms=['%']) == []
+    assert stat.index.query(topics=['wrench', 'joint_states']) == files
+    assert stat.index.query(min_duration=1.25) == files[4:]
+
+    trial = stat.index.get_trial(files[0])
+    assert trial['sample_counts'] == {'joint_states': 5, 'wrench': 10}
+    assert abs(trial['duration'] - 0.9) < 1e-9
+
+
+def test_sort_term_change_rebins(tmp_path):
+    folder = _make_data_set(tmp_path, num_reps=2)
+    stat = _make_stat_gen(tmp_path)
+    stat.update_index([['sphere'], ['top_grasp']])
+    assert stat.index.query(bins=['sphere;top_grasp']) != []
+
+    stat.update_index([['sphere', 'cube'], ['top_grasp_2']])
+    assert stat.index.query(bins=['sphere;top_grasp']) == []
+    assert stat.index.query(bins=['sphere;top_grasp_2']) == [str(folder / 'pos_0000_planned_0.pkl'),
+                                                             str(folder / 'pos_0000_planned_1.pkl')]
+
+    stat.update_index([['cube'], ['top_grasp']])
+    assert stat.index.query() == []